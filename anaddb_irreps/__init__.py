@@ -1 +1 @@
-from .irreps_anaddb import IrRepsAnaddb
+from .irreps_anaddb import IrRepsAnaddb, print_irreps
@@ -1,6 +1,8 @@
+import functools
+import os
+
 import numpy as np
 from ase.data import atomic_masses
-import abipy.abilab as abilab
 from phonopy.structure.atoms import PhonopyAtoms
 
 
@@ -33,44 +35,132 @@ def displacement_cart_to_evec(displ_cart,
     """
     if add_phase and qpoint is None:
         raise ValueError('qpoint must be given if adding phase is needed')
-    m = np.sqrt(np.kron(masses, [1, 1, 1]))
+    m = np.repeat(np.sqrt(masses), 3)
     evec = displ_cart * m
     if add_phase:
-        phase = [
-            np.exp(-2j * np.pi * np.dot(pos, qpoint))
-            for pos in scaled_positions
-        ]
-        phase = np.kron(phase, [1, 1, 1])
+        pos = np.asarray(scaled_positions)
+        phase = np.repeat(np.exp(-2j * np.pi * (pos @ np.asarray(qpoint))), 3)
         evec *= phase
         evec /= np.linalg.norm(evec)
     return evec
 
 
-def read_phbst_freqs_and_eigvecs(fname):
-    ncfile = abilab.abiopen(fname)
-    struct = ncfile.structure
-    atoms = ncfile.structure.to_ase_atoms()
-    scaled_positions = struct.frac_coords
-
-    numbers = struct.atomic_numbers
-    masses = [atomic_masses[i] for i in numbers]
-
-    phbst = ncfile.phbands
-    qpoints = phbst.qpoints.frac_coords
-    nqpts = len(qpoints)
-    nbranch = 3 * len(numbers)
-    evecs = np.zeros([nqpts, nbranch, nbranch], dtype='complex128')
-
-    freqs = phbst.phfreqs
-    displ_carts = phbst.phdispl_cart
-
-    for iqpt, qpt in enumerate(qpoints):
-        for ibranch in range(nbranch):
-            evec = displacement_cart_to_evec(displ_carts[iqpt, ibranch, :],
-                                             masses,
-                                             scaled_positions,
-                                             qpoint=qpt,
-                                             add_phase=True)
-            evecs[iqpt, :, ibranch] = evec
+def displacements_cart_to_evecs(displ_carts,
+                                masses,
+                                scaled_positions,
+                                qpoint=None,
+                                add_phase=True):
+    """
+    Batched version of displacement_cart_to_evec for all branches at one
+    qpoint.
+    displ_carts: cartisien displacements of all branches, shape [nbranch, 3N].
+    masses: masses of atoms.
+    scaled_postions: scaled postions of atoms.
+    qpoint: if phase needs to be added, qpoint must be given.
+    add_phase: whether to add phase to the eigenvectors.
+    Returns the eigenvectors as rows, shape [nbranch, 3N].
+    """
+    if add_phase and qpoint is None:
+        raise ValueError('qpoint must be given if adding phase is needed')
+    m = np.repeat(np.sqrt(masses), 3)
+    evecs = displ_carts * m
+    if add_phase:
+        pos = np.asarray(scaled_positions)
+        phase = np.repeat(np.exp(-2j * np.pi * (pos @ np.asarray(qpoint))), 3)
+        evecs = evecs * phase
+        evecs /= np.linalg.norm(evecs, axis=1, keepdims=True)
+    return evecs
+
+
+def read_phbst_freqs_and_eigvecs(fname, dtype=np.complex128):
+    """
+    Read atoms, qpoints, frequencies and eigenvectors from a PHBST file.
+    The result is cached on (path, mtime), so building several IrReps
+    objects for different qpoints of the same file parses it only once.
+    dtype: dtype of the eigenvectors. complex64 halves the memory
+        traffic and is accurate enough for irreps/degeneracy analysis.
+    """
+    return _read_phbst_cached(os.path.abspath(fname), os.path.getmtime(fname),
+                              np.dtype(dtype))
+
+
+@functools.lru_cache(maxsize=4)
+def _read_phbst_cached(fname, mtime, dtype):
+    # Optional on-disk cache: set ANADDB_IRREPS_CACHE=1 to keep an npz
+    # sidecar next to the PHBST file and skip the NetCDF parse when it
+    # is still up to date.
+    cache = fname + '.irreps_cache.npz'
+    use_cache = os.environ.get('ANADDB_IRREPS_CACHE', '0') == '1'
+    if use_cache and os.path.exists(cache) and os.path.getmtime(
+            cache) >= mtime:
+        return _load_phbst_sidecar(cache, dtype)
+    result = _read_phbst(fname, dtype)
+    if use_cache:
+        atoms, qpoints, freqs, evecs = result
+        np.savez_compressed(cache,
+                            numbers=atoms.get_atomic_numbers(),
+                            scaled_positions=atoms.get_scaled_positions(),
+                            cell=np.asarray(atoms.get_cell()),
+                            qpoints=qpoints,
+                            freqs=freqs,
+                            evecs=evecs)
+    return result
+
+
+def _load_phbst_sidecar(cache, dtype):
+    from ase import Atoms
+    with np.load(cache) as data:
+        atoms = Atoms(numbers=data['numbers'],
+                      scaled_positions=data['scaled_positions'],
+                      cell=data['cell'],
+                      pbc=True)
+        # the sidecar keeps whatever dtype it was written with; honour
+        # the dtype requested for this read.
+        evecs = data['evecs'].astype(dtype, copy=False)
+        return atoms, data['qpoints'], data['freqs'], evecs
+
+
+def _read_phbst(fname, dtype=np.complex128):
+    # abipy is slow to import (it pulls in pymatgen); defer it so that
+    # importing anaddb_irreps stays cheap until a file is actually read.
+    import abipy.abilab as abilab
+    with abilab.abiopen(fname) as ncfile:
+        struct = ncfile.structure
+        atoms = ncfile.structure.to_ase_atoms()
+        scaled_positions = np.ascontiguousarray(struct.frac_coords,
+                                                dtype=np.float64)
+
+        numbers = struct.atomic_numbers
+        masses = atomic_masses[np.asarray(numbers, dtype=np.intp)]
+
+        phbst = ncfile.phbands
+        qpoints = np.ascontiguousarray(phbst.qpoints.frac_coords,
+                                       dtype=np.float64)
+
+        freqs = np.asarray(phbst.phfreqs)
+        displ_carts = phbst.phdispl_cart
+
+    # Phase factors for every (qpoint, atom) pair from a single matrix
+    # product; the per-qpoint scale vector combines mass and phase.
+    m = np.repeat(np.sqrt(masses), 3)
+    phase_atom = np.exp(-2j * np.pi * (qpoints @ scaled_positions.T))
+    scale = (m * np.repeat(phase_atom, 3, axis=1)).astype(dtype)
+    if np.dtype(dtype) != np.asarray(displ_carts).dtype:
+        displ_carts = np.asarray(displ_carts, dtype=dtype)
+
+    # Work on slabs of qpoints so the peak memory stays at one output
+    # array plus one slab-sized temporary, instead of three full-size
+    # (nqpts, nbranch, 3N) complex arrays for dense q-grids.
+    nqpts, nbranch = np.shape(displ_carts)[:2]
+    evecs = np.empty((nqpts, nbranch, nbranch), dtype=dtype)
+    chunk = 64
+    for q0 in range(0, nqpts, chunk):
+        q1 = min(q0 + chunk, nqpts)
+        slab = displ_carts[q0:q1] * scale[q0:q1, None, :]
+        inv_nrm = 1.0 / np.sqrt(
+            np.einsum('qbi,qbi->qb', slab.conj(), slab).real)
+        slab *= inv_nrm[:, :, None]
+        # columns of evecs[iqpt] are the eigenvectors.
+        evecs[q0:q1] = np.transpose(slab, (0, 2, 1))
 
     return atoms, qpoints, freqs, evecs
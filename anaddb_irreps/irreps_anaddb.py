@@ -7,6 +7,76 @@ from anaddb_irreps.abipy_io import read_phbst_freqs_and_eigvecs, ase_atoms_to_ph
 from phonopy.phonon.degeneracy import degenerate_sets as get_degenerate_sets
 from phonopy.structure.cells import is_primitive_cell
 
+# 1 eV in cm^-1; anaddb PHBST frequencies are in eV.
+EV_TO_CM1 = 8065.54429
+
+# Row layout of the mode summary table; module-level so the format spec
+# is parsed once, not per row.
+_SUMMARY_HEADER = 'band        freq   freq(cm^-1)  label   IR  Raman'
+_SUMMARY_ROW = '{:4d}  {:10.6f}  {:12.2f}  {:>5s}  {:^3s}  {:^5s}'
+
+# Column pairs of the quadratic-function basis (x^2, xy, y^2, xz, yz, z^2)
+# and the projection of a flattened 3x3 outer product onto that basis.
+_QUAD_I = np.array([0, 1, 1, 2, 2, 2])
+_QUAD_J = np.array([0, 0, 1, 0, 1, 2])
+_QUAD_PROJ = np.zeros((6, 9))
+for _row, (_a, _b) in enumerate(zip(_QUAD_I, _QUAD_J)):
+    _QUAD_PROJ[_row, 3 * _a + _b] = 1.0
+    _QUAD_PROJ[_row, 3 * _b + _a] = 1.0
+del _row, _a, _b
+
+# Static arrays derived from phonopy's character-table dicts, built once
+# per table. The tables are module-level read-only data in phonopy, so
+# their id() is a stable cache key within a process.
+_character_table_cache = {}
+
+# IR/Raman activity dicts per (character table, cell): for a given point
+# group and orientation the answer is fixed, so the projection runs once
+# and later calls are table lookups.
+_ir_raman_cache = {}
+
+# Symmetry datasets keyed on the primitive cell and symprec: the spglib
+# analysis does not depend on the qpoint, so sweeps over qpoints of one
+# structure run it only once.
+_symmetry_cache = {}
+
+
+def _get_symmetry_dataset(primitive, symprec):
+    key = (np.asarray(primitive.cell).tobytes(),
+           np.asarray(primitive.numbers).tobytes(),
+           np.asarray(primitive.scaled_positions).tobytes(), symprec)
+    dataset = _symmetry_cache.get(key)
+    if dataset is None:
+        dataset = Symmetry(primitive, symprec=symprec).get_dataset()
+        _symmetry_cache[key] = dataset
+    return dataset
+
+
+def _character_table_static(table):
+    """
+    Return (degenclass, symops, irrep_labels, C) for a phonopy character
+    table: per-class op counts, the zero-padded (nclass, nop_max, 3, 3)
+    array of reduced-coordinate symops, the irrep labels, and the
+    stacked character matrix.
+    """
+    cached = _character_table_cache.get(id(table))
+    if cached is None:
+        mapping_table = table['mapping_table']
+        mapping_keys = tuple(mapping_table.keys())
+        nclass = len(table['rotation_list'])
+        degenclass = np.array([len(mapping_table[k]) for k in mapping_keys])
+        nop_max = int(degenclass.max())
+        symops = np.zeros([nclass, nop_max, 3, 3])
+        for iclass, opclass in enumerate(mapping_keys):
+            ops = np.asarray(mapping_table[opclass])
+            symops[iclass, :len(ops)] = ops
+        char_dict = table['character_table']
+        irrep_labels = tuple(char_dict.keys())
+        C = np.array([char_dict[lbl] for lbl in irrep_labels], dtype=float)
+        cached = (degenclass, symops, irrep_labels, C)
+        _character_table_cache[id(table)] = cached
+    return cached
+
 
 class IrRepsEigen(IrReps):
     def __init__(
@@ -26,16 +96,31 @@ class IrRepsEigen(IrReps):
         self._q = np.array(q)
         self._degeneracy_tolerance = degeneracy_tolerance
         self._symprec = symprec
+        self._is_gamma = bool((np.abs(self._q) < symprec).all())
         self._primitive = primitive_atoms
         # self._primitive = dynamical_matrix.get_primitive()
         # self._dynamical_matrix = dynamical_matrix
         # self._ddm = DerivativeOfDynamicalMatrix(dynamical_matrix)
-        self._freqs, self._eigvecs = freqs, eigvecs
+        # coerce the frequencies once so degeneracy grouping and unit
+        # conversion work on a typed array; the eigenvector dtype is left
+        # to the caller (see the dtype option of the PHBST reader).
+        self._freqs = np.asarray(freqs, dtype=np.float64)
+        self._eigvecs = eigvecs
         self._character_table = None
+        self._summary_cache = None
+        self._summary_columns_cache = None
+        self._ir_active_set = frozenset()
+        self._raman_active_set = frozenset()
 
     def run(self):
-        self._symmetry_dataset = Symmetry(self._primitive,
-                                          symprec=self._symprec).get_dataset()
+        self._summary_cache = None
+        self._summary_columns_cache = None
+        self._symmetry_dataset = _get_symmetry_dataset(
+            self._primitive, self._symprec)
+        # real and reciprocal primitive vectors for the Cartesian symop
+        # construction; they depend only on the cell, so invert once here.
+        self._rprim = self._primitive.cell
+        self._gprim = np.linalg.inv(self._rprim).T
 
 #        if not self._is_primitive_cell():
 #            print('')
@@ -70,13 +155,17 @@ class IrRepsEigen(IrReps):
             self._rotation_symbols = self._get_rotation_symbols()
             #print (" char tab ", self._character_table)
 
-            if (abs(self._q) < self._symprec).all() and self._rotation_symbols:
+            if self._is_gamma and self._rotation_symbols:
                 self._ir_labels = self._get_ir_labels()
                 self._RamanIR_labels = self._get_infrared_raman()
                 IR_labels, Ram_labels = self._RamanIR_labels
+                self._ir_active_set = frozenset(
+                    filter(None, IR_labels.values()))
+                self._raman_active_set = frozenset(
+                    lbl for lbls in Ram_labels.values() for lbl in lbls)
                 print ("IR  labels ", IR_labels)
                 print ("Ram labels ", Ram_labels)
-            elif (abs(self._q) < self._symprec).all():
+            elif self._is_gamma:
                 if self._log_level > 0:
                     print("Database for this point group is not preprared.")
             else:
@@ -97,62 +186,52 @@ class IrRepsEigen(IrReps):
         http://symmetry.jacobs-university.de/cgi-bin/group.cgi?group=606&option=4
         """
 # make symops in cartesian space
-        rprim = self._primitive.cell  #np.identity(3)
-        gprim = np.linalg.inv(rprim).T
-        #print (" R G ", rprim, gprim)
-        #print ("rot ", self._rotations_at_q)
+        rprim = self._rprim
+        gprim = self._gprim
 
 # make cartesian symop matrices for each operation in each class
 # then get characters for IR and Raman reducible representations
-        nclass = len(self._character_table['rotation_list'])
-        self._cartesian_rotations_at_q = np.zeros([nclass,96,3,3])
-        degenclass = np.zeros(nclass)
-        characters_xyz = np.zeros(nclass)
-        chardegen_xyz = np.zeros(nclass)
-        characters_x2 = np.zeros(nclass)
-        chardegen_x2 = np.zeros(nclass)
-        iclass = 0
-        for opclass in self._character_table['mapping_table'].keys():
-          degenclass[iclass] = len(self._character_table['mapping_table'][opclass])
-          iop = 0
-          for symop in  np.array(self._character_table['mapping_table'][opclass][:]):
-            #print ("rotred ", symop)
-            self._cartesian_rotations_at_q[iclass][iop] = np.dot(rprim, np.dot(symop, gprim.T))
-            #print (" rotcart ", self._cartesian_rotations_at_q[isym])
-
-            #m = self._cartesian_rotations_at_q[iclass][iop]
-            #character_x2_iop =  np.matrix.trace(np.block([[m*m[0,0], m*m[0,1], m*m[0,2]],\
-            #                                              [m*m[1,0], m*m[1,1], m*m[1,2]],\
-            #                                              [m*m[2,0], m*m[2,1], m*m[2,2]]]))
-            #print ("class ", opclass, " op ", iop, " character ", character_x2_iop)
-
-            iop += 1 
-
-          m = self._cartesian_rotations_at_q[iclass][0]
-# get representation characters for x,y,z functions
-          characters_xyz[iclass] = np.matrix.trace(m)
-
-# get representation characters for quadratic functions
-# line below is in x2 xy y2 xz yz z2 format
-          bigmat = np.zeros([6,6])
-          ibig = 0
-          for ixyz in range(3):
-            for ixyz_prime in range(ixyz+1):
-              outprod = np.ndarray.flatten(np.outer(m[:,ixyz],m[:,ixyz_prime]))
-              bigmat[ibig,:] = [outprod[0], \
-                 outprod[1]+outprod[3], outprod[4], \
-                 outprod[2]+outprod[6], outprod[5]+outprod[7], outprod[8]]
-                
-              ibig += 1
-          #print (" class ", iclass, opclass, " x2 matrix", bigmat)
-
-          characters_x2[iclass] = np.matrix.trace(bigmat)
-          #print (" class ", iclass, "x2 charac ", characters_x2[iclass])
-
-          chardegen_xyz[iclass] = characters_xyz[iclass]*degenclass[iclass]
-          chardegen_x2[iclass]  = characters_x2[iclass]*degenclass[iclass]
-          #print ("xyz charac ", characters_xyz[iclass], " degen ", self._degenclass[iclass])
-          iclass += 1
+        (degenclass, symops, irrep_labels,
+         C) = _character_table_static(self._character_table)
+        nclass, nop_max = symops.shape[:2]
+        # rprim @ symop @ gprim.T for every (class, op) in one batched
+        # product; classes with fewer ops are zero-padded. Set before the
+        # cache check so the attribute exists on cache hits too.
+        self._cartesian_rotations_at_q = np.einsum('ij,cojk,lk->coil', rprim,
+                                                   symops, gprim)
+
+        cache_key = (id(self._character_table),
+                     np.asarray(rprim).round(10).tobytes())
+        cached = _ir_raman_cache.get(cache_key)
+        if cached is not None:
+            IR_dict, Raman_dict = cached
+            # copies, so callers mutating the dicts cannot poison the cache
+            return dict(IR_dict), {k: list(v) for k, v in Raman_dict.items()}
+
+# The arrays here are tiny (a few KB even for the largest point groups),
+# so this path is Python-dispatch-bound rather than FLOP- or
+# memory-bound; the batched einsums keep the 3x3 / 6x6 blocks innermost
+# and contiguous so each reduction is a single pass over the data.
+# quadratic-basis rows of every (class, op) rotation, summed over the ops
+# of each class: all ops of a class carry the same character coefficient,
+# so only the per-class sums are needed in the projections below.
+        M = self._cartesian_rotations_at_q
+        R_class_sum = M.sum(axis=1)
+        quad_rows = np.einsum('coap,cobp->copab', M[:, :, :, _QUAD_I],
+                              M[:, :, :, _QUAD_J]).reshape(
+                                  nclass, nop_max, 6, 9) @ _QUAD_PROJ.T
+        quad_sum_per_class = quad_rows.sum(axis=1)
+
+# representation characters for the x,y,z and quadratic functions, taken
+# from the first (representative) op of each class with batched traces.
+# For the quadratic functions the symmetric-square trace identity
+# chi_x2(R) = (chi(R)^2 + chi(R^2)) / 2 replaces the 6x6 trace.
+        M1 = M[:, 0]
+        characters_xyz = np.einsum('cii->c', M1)
+        characters_x2 = 0.5 * (characters_xyz**2 +
+                               np.einsum('cij,cji->c', M1, M1))
+        chardegen_xyz = characters_xyz * degenclass
+        chardegen_x2 = characters_x2 * degenclass
 
 # now we have red representations, project them into irreps
         #print ("irrep  characters g = ", self._g)
@@ -161,62 +240,146 @@ class IrRepsEigen(IrReps):
         IR_dict={'x':None, 'y':None, 'z':None}
         Raman_dict={'x^2':[],'xy':[],'y^2':[],'xz':[],'yz':[],'z^2':[]}
 
-# loop over irreducible representations
-        i_ir = 0
-        for irreplabel in self._character_table['character_table'].keys():
-          # characters
-          irr_char = self._character_table['character_table'][irreplabel]
-          # l_n dimention of current irreps
-          len_irr = irr_char[0]
-          # number of ir modes here
-          n_ir = int(np.dot(irr_char,chardegen_xyz)/self._g)
-          # number of Raman modes here
-          n_ram = int(np.dot(irr_char,chardegen_x2)/self._g)
-          #print (irreplabel, " nir ", n_ir, " nram ", n_ram, " irchar ", irr_char)
+# project the x,y,z and quadratic-function representations onto every
+# irrep with two batched contractions; nonzero row norms flag activity.
+        len_irr_vec = C[:, 0]
+        # number of IR / Raman modes per irrep
+        n_ir_vec = (C @ chardegen_xyz / self._g).astype(int)
+        n_ram_vec = (C @ chardegen_x2 / self._g).astype(int)
+
+        scale = (len_irr_vec / self._g)[:, None, None]
+        xyz_all = np.einsum('rc,cij->rij', C, R_class_sum) * scale
+        x2_all = np.einsum('rc,cpq->rpq', C, quad_sum_per_class) * scale
+        ir_mask = np.linalg.norm(xyz_all, axis=2) > 1.e-6
+        raman_mask = np.linalg.norm(x2_all, axis=2) > 1.e-6
 
+        for i_ir, irreplabel in enumerate(irrep_labels):
 # find eigenvectors: are x y or z isolated in representation?
 # IR
-          for ixyz in range(3):
-            xyzvec = np.zeros(3)
-            for iclass in range(len(self._character_table['mapping_table'].keys())):
-              opclass = list(self._character_table['mapping_table'].keys())[iclass]
-              degenclass = len(self._character_table['mapping_table'][opclass][:])
-              for iop in range(degenclass):
-                xyzvec += irr_char[iclass] * self._cartesian_rotations_at_q[iclass][iop][ixyz,:]
-            xyzvec *= len_irr/self._g
-            if np.linalg.norm(xyzvec) > 1.e-6:
-              IR_dict[xyzlabels[ixyz]] = irreplabel
-
-# find the irreps which contain each of the quadratic functions (not full linear combination basis functions, but still)
+            for ixyz in range(3):
+                if ir_mask[i_ir, ixyz]:
+                    IR_dict[xyzlabels[ixyz]] = irreplabel
+# find the irreps which contain each of the quadratic functions (not full
+# linear combination basis functions, but still)
 # Raman
-          ibig = 0
-          bigvec = np.zeros(6)
-          for ixyz in range(3):
-            for ixyz_prime in range(ixyz+1):
-              x2vec = np.zeros(6)
-# loop over all operations
-              for iclass in range(len(self._character_table['mapping_table'].keys())):
-                opclass = list(self._character_table['mapping_table'].keys())[iclass]
-                degenclass = len(self._character_table['mapping_table'][opclass][:])
-                for iop in range(degenclass):
-                  m = self._cartesian_rotations_at_q[iclass][iop]
-                  outprod = np.ndarray.flatten(np.outer(m[:,ixyz],m[:,ixyz_prime]))
-                  bigvec = np.array([outprod[0], \
-                     outprod[1]+outprod[3], outprod[4], \
-                     outprod[2]+outprod[6], outprod[5]+outprod[7], outprod[8]])
-                  x2vec  += irr_char[iclass] * bigvec
-
-              x2vec *= len_irr/self._g
-              if np.linalg.norm(x2vec) > 1.e-6:
-                #print (x2labels[ibig], " belongs to ", irreplabel , " norm ", np.linalg.norm(x2vec))
-                Raman_dict[x2labels[ibig]].append(irreplabel)
-
-              ibig += 1
-# loop over irreps
-          i_ir += 1
-
+            for ibig in range(6):
+                if raman_mask[i_ir, ibig]:
+                    Raman_dict[x2labels[ibig]].append(irreplabel)
+
+        _ir_raman_cache[cache_key] = (dict(IR_dict), {
+            k: list(v)
+            for k, v in Raman_dict.items()
+        })
         return IR_dict, Raman_dict
 
+    def get_summary_table(self):
+        """
+        One dict per phonon mode with the band index, frequency (in the
+        unit of the input file, eV for anaddb), frequency in cm^-1, the
+        irrep label (None if not available) and the IR/Raman activity.
+        run() must have been called first; the table is cached until the
+        next run().
+        """
+        if self._summary_cache is not None:
+            return self._summary_cache
+        cols = self.get_summary_columns()
+        summary = [None] * len(cols['label'])
+        for iband in range(len(summary)):
+            summary[iband] = {
+                'band_index': int(cols['band_index'][iband]),
+                'freq': float(cols['freq'][iband]),
+                'freq_cm1': float(cols['freq_cm1'][iband]),
+                'label': cols['label'][iband],
+                'ir_active': bool(cols['ir_active'][iband]),
+                'raman_active': bool(cols['raman_active'][iband]),
+            }
+        self._summary_cache = summary
+        return summary
+
+    def get_summary_columns(self):
+        """
+        Structure-of-arrays view of the mode summary: a dict with the
+        band_index, freq and freq_cm1 arrays, the list of irrep labels
+        (None if not available) and boolean IR/Raman activity arrays.
+        run() must have been called first; the columns are cached until
+        the next run().
+        """
+        if self._summary_columns_cache is not None:
+            return self._summary_columns_cache
+        freqs = self._freqs
+        nmodes = len(freqs)
+        if self._ir_labels is None:
+            # No labels could be assigned: skip the degenerate-set
+            # mapping and the activity lookups entirely.
+            labels = [None] * nmodes
+            ir_active = np.zeros(nmodes, dtype=bool)
+            raman_active = np.zeros(nmodes, dtype=bool)
+        else:
+            mode_to_degset = np.full(nmodes, -1, dtype=np.intp)
+            for iset, deg_set in enumerate(self._degenerate_sets):
+                mode_to_degset[list(deg_set)] = iset
+            labels = [
+                self._ir_labels[iset] if iset >= 0 else None
+                for iset in mode_to_degset
+            ]
+            ir_active = np.fromiter(
+                (label in self._ir_active_set for label in labels),
+                dtype=bool,
+                count=nmodes)
+            raman_active = np.fromiter(
+                (label in self._raman_active_set for label in labels),
+                dtype=bool,
+                count=nmodes)
+        cols = {
+            'band_index': np.arange(nmodes),
+            'freq': freqs,
+            'freq_cm1': freqs * EV_TO_CM1,
+            'label': labels,
+            'ir_active': ir_active,
+            'raman_active': raman_active,
+        }
+        self._summary_columns_cache = cols
+        return cols
+
+    def invalidate_summary_cache(self):
+        """
+        Drop the cached summary table. run() does this automatically;
+        call it only after changing the analysis results in place.
+        """
+        self._summary_cache = None
+        self._summary_columns_cache = None
+
+    def iter_summary_lines(self, include_header=True):
+        """
+        Yield the summary table line by line, so callers can stream the
+        output instead of materializing the whole table string.
+        """
+        if include_header:
+            yield _SUMMARY_HEADER
+        cols = self.get_summary_columns()
+        for iband, (freq, freq_cm1, label, ir, raman) in enumerate(
+                zip(cols['freq'], cols['freq_cm1'], cols['label'],
+                    cols['ir_active'], cols['raman_active'])):
+            yield _SUMMARY_ROW.format(iband, freq, freq_cm1,
+                                      label if label is not None else '-',
+                                      'yes' if ir else '-',
+                                      'yes' if raman else '-')
+
+    def write_summary_table(self, stream, include_header=True):
+        """
+        Write the summary table to a file-like object line by line,
+        without building the joined table string in memory.
+        """
+        for line in self.iter_summary_lines(include_header=include_header):
+            stream.write(line + '\n')
+
+    def format_summary_table(self):
+        """
+        Format the mode summary of get_summary_table as a text table.
+        """
+        return '\n'.join(self.iter_summary_lines())
+
+
 class IrRepsAnaddb(IrRepsEigen):
     def __init__(self,
                  phbst_fname,
@@ -246,3 +409,21 @@ class IrRepsAnaddb(IrRepsEigen):
                          symprec=symprec,
                          degeneracy_tolerance=degeneracy_tolerance,
                          log_level=log_level)
+
+
+def print_irreps(phbst_fname, ind_qs, **kwargs):
+    """
+    Run the irreps analysis for several qpoints of one PHBST file and
+    print the summary table of each. The file is parsed only once (the
+    reader caches on path and mtime), so the per-qpoint cost is just the
+    symmetry analysis and projection.
+    phbst_fname: name of phbst file.
+    ind_qs: iterable of qpoint indices in the phbst.
+    kwargs are passed on to IrRepsAnaddb.
+    """
+    for ind_q in ind_qs:
+        irr = IrRepsAnaddb(phbst_fname, ind_q, **kwargs)
+        irr.run()
+        print("# qpoint index {}".format(ind_q))
+        for line in irr.iter_summary_lines():
+            print(line)